@@ -1,9 +1,10 @@
 import argparse
 from pathlib import Path
+from collections.abc import Callable
 from transcript import Transcript
 from datetime import timedelta
-import re
 import sys
+from typing import TextIO
 
 class SilenceAction(argparse.Action):
     def __call__(self, parser, namespace, thresh, option_string=None):
@@ -15,68 +16,57 @@ class SilenceAction(argparse.Action):
 
 class MapAction(argparse.Action):
     def __call__(self, parser, namespace, pairs, option_string=None):
-        map_pattern = r'([^\:]+\:[^\:]+,)*([^\:]+\:[^\:]+)'
         result = dict()
-        if re.match(map_pattern, pairs) is not None:
-            for pair in pairs.split(','):
-                key,value = pair.split(':')
-                result[key] = value
-            setattr(namespace, self.dest, result)
-        else:
-            parser.error(f"Invalid key value pair structure (expected <key1:value1,key2:value2,...>, got {pairs})")
+        for pair in pairs.split(','):
+            key, sep, value = pair.partition(':')
+            if not key or not sep or not value or ':' in value:
+                parser.error(f"Invalid key value pair structure (expected <key1:value1,key2:value2,...>, got {pairs})")
+            result[key] = value
+        setattr(namespace, self.dest, result)
+
+def write_output(out: Path|None, write: Callable[[TextIO], None]) -> None:
+    if out is None:
+        write(sys.stdout)
+        return
+    with open(out, 'w', buffering=1 << 16) as out_file:
+        write(out_file)
 
 def run_merge(args:argparse.Namespace):
-    ts = Transcript.parse_transcript(args.filepath)
+    ts = Transcript.parse_transcript(args.filepath, cache=args.cache)
     result = Transcript()
     silence_thresh = args.silence_thresh
     if args.merger == 'silence':
         result = ts.merge_by_silence_interval(silence_thresh, ignore_speakers=True)
     else:
         result = ts.merge_by_silence_interval(silence_thresh)
-    out_file = sys.stdout
-    if args.out is not None:
-        out_file = open(args.out, 'w')
-    print(str(result), file=out_file)
+    write_output(args.out, result.write_to)
 
 def run_map(args:argparse.Namespace):
-    ts = Transcript.parse_transcript(args.filepath)
+    ts = Transcript.parse_transcript(args.filepath, cache=args.cache)
     result = ts.map_speakers(args.speakers)
-    out_file = sys.stdout
-    if args.out is not None:
-        out_file = open(args.out, 'w')
-    print(str(result), file=out_file)
+    write_output(args.out, result.write_to)
+
+_INFO_STATS: dict[str, Callable[[Transcript], object]] = {
+    'num_lines': Transcript.num_lines,
+    'total_duration': Transcript.total_time,
+    'total_speaking_time': Transcript.total_speaking_time,
+    'avg_speaking_time': Transcript.avg_speaking_time,
+    'med_speaking_time': Transcript.median_speaking_time,
+    'total_silence': Transcript.total_silence,
+    'avg_silence': Transcript.avg_silence,
+    'med_silence': Transcript.median_silence,
+    'speakers': lambda ts: '\n    ' + ts.show_speakers().replace('\n', '\n    '),
+}
 
 def run_info(args:argparse.Namespace):
-    ts = Transcript.parse_transcript(args.filepath)
-    for arg, value in vars(args).items():
-        if value == True:
-            match arg:
-                case 'num_lines':
-                   print(f'num_lines: {len(ts.get_lines())}')
-                case 'total_duration':
-                   print(f'total_duration: {str(ts.total_time())}')
-                case 'total_speaking_time':
-                   print(f'total_speaking_time: {str(ts.total_speaking_time())}')
-                case 'avg_speaking_time':
-                   print(f'avg_speaking_time: {str(ts.avg_speaking_time())}')
-                case 'med_speaking_time':
-                   print(f'med_speaking_time: {str(ts.median_speaking_time())}')
-                case 'total_silence':
-                   print(f'total_silence: {str(ts.total_silence())}')
-                case 'avg_silence':
-                   print(f'avg_silence: {str(ts.avg_silence())}')
-                case 'med_silence':
-                   print(f'med_silence: {str(ts.median_silence())}')
-                case 'speakers':
-                   print(f'speakers: \n    {"\n    ".join(ts.show_speakers().split('\n'))}')
+    ts = Transcript.parse_transcript(args.filepath, cache=args.cache)
+    for arg, stat in _INFO_STATS.items():
+        if getattr(args, arg):
+            print(f'{arg}: {stat(ts)}')
 
 def run_pretty(args):
-    ts = Transcript.parse_transcript(args.filepath)
-    result = ts.consolidate()
-    out_file = sys.stdout
-    if args.out is not None:
-        out_file = open(args.out, 'w')
-    print(str(result), file=out_file)
+    ts = Transcript.parse_transcript(args.filepath, cache=args.cache)
+    write_output(args.out, ts.write_consolidated)
 
 
 if __name__ == '__main__':
@@ -84,11 +74,12 @@ if __name__ == '__main__':
         description='parses a .vtt transcript'
     )
     parser.add_argument('filepath', help='path to a .vtt transcript file', type=Path)
+    parser.add_argument('--cache', help='reuse a parsed copy of the transcript saved next to it as <name>.vttc, creating it if missing or stale. The .vttc is loaded with pickle, so only use this where that file can be trusted', action='store_true')
     subparsers = parser.add_subparsers()
 
     merge = subparsers.add_parser('merge', help='merge transcript lines by speaker or silence between lines.')
     merge.add_argument('--merger', choices=['speaker', 'silence'], default='speaker')
-    merge.add_argument('--silence_thresh', type=float, default=0, help='maximum silence threshold to ignore while merging', action=SilenceAction)
+    merge.add_argument('--silence_thresh', type=float, default=timedelta(), help='maximum silence threshold to ignore while merging', action=SilenceAction)
     merge.add_argument('--out', required=False, help='file path to save new transcript into. If not specified, result will be printed instead.', type=Path)
     merge.set_defaults(func=run_merge)
 
@@ -1,60 +1,184 @@
-import re
-from datetime import datetime, timedelta
+import heapq
+import os
+import pickle
+import statistics
+from datetime import timedelta
 import sys
+import tempfile
 from collections.abc import Callable
 from pathlib import Path
+from typing import TextIO
+
+# bump whenever the pickled layout of Transcript/TranscriptLine changes so stale .vttc caches are ignored
+_CACHE_VERSION = 4
+
+_MICROSECOND = timedelta(microseconds=1)
+
+# webvtt blocks that carry no cue and are skipped while parsing; the keyword must be alone on the first line
+# or followed by a space or tab, so cue identifiers such as 'NOTEBOOK-1' are still parsed as cues
+_NON_CUE_BLOCKS = ('NOTE', 'STYLE', 'REGION')
+_NON_CUE_PREFIXES = tuple(keyword + sep for keyword in _NON_CUE_BLOCKS for sep in (' ', '\t'))
+
+# digit-group lookup tables for the fixed-width HH:MM:SS.mmm timestamp, cheaper than calling int() on each field;
+# they only hold ASCII digit groups in range, so anything else (non-ASCII digits, minutes or seconds past 59) misses
+_TWO_DIGITS = {f'{i:02d}': i for i in range(100)}
+_SIXTY = {f'{i:02d}': i for i in range(60)}
+_MILLISECONDS_US = {f'{i:03d}': i * 1000 for i in range(1000)}
 
 class Transcript:    
     def __init__(self):
         self.__lines: list['TranscriptLine'] = []
-        self.__speakers: set[str] = set()
-        self.__silence_intervals: list[timedelta] = []
-        self.__total_speaking_time: timedelta = timedelta()
-        self.__total_silence: timedelta = timedelta()
+        self.__speakers: dict[str, None] = {}
+        # all times below are integer microseconds, converted to timedelta only when returned
+        self.__silence_intervals: list[int] = []
+        self.__durations: list[int] = []
+        self.__total_speaking_time: int = 0
+        self.__total_silence: int = 0
+        self.__lower_silences: list[int] = []
+        self.__upper_silences: list[int] = []
+        self.__silence_mean: float = 0.0
+        self.__silence_m2: float = 0.0
 
     @classmethod
-    def parse_transcript(cls, path: Path) -> 'Transcript':
+    def parse_transcript(cls, path: Path, cache: bool=False) -> 'Transcript':
+        """
+        parses a vtt transcript file
+
+        args:
+            cache: if True, reuse the parsed transcript pickled next to the file as <name>.vttc when it was written for a file
+                with the same modification time and size, otherwise parse the file and try to write that cache.
+                The cache is unpickled, so only use it on trusted files
+        """
+        path = Path(path)
+        cache_path = path.with_suffix('.vttc')
+        if cache:
+            source_stat = path.stat()
+            source_key = (source_stat.st_mtime_ns, source_stat.st_size)
+            cached = cls.__load_cache(cache_path, source_key)
+            if cached is not None:
+                return cached
         obj = cls()
-        with open(path, 'r') as t:
-            lines = t.read().strip().split('\n\n')
-            if lines[0] == 'WEBVTT':
-                lines = lines[1:]
-            for line in lines:
-                obj.__add_item(TranscriptLine.parse_line(line))
+        with open(path, 'rb', buffering=128 * 1024) as t:
+            data = t.read().decode('utf-8-sig').replace('\r\n', '\n').strip()
+        blocks = data.split('\n\n')
+        if blocks[0].startswith('WEBVTT'):
+            blocks = blocks[1:]
+        add_item, parse_line = obj.__add_item, TranscriptLine.parse_line
+        for block in blocks:
+            block = block.lstrip('\n')
+            if not block or (block.startswith(_NON_CUE_BLOCKS) and cls.__is_non_cue(block)):
+                continue
+            add_item(parse_line(block))
+        if cache:
+            obj.__write_cache(cache_path, source_key)
         return obj
 
+    @staticmethod
+    def __is_non_cue(block: str) -> bool:
+        first_line = block.partition('\n')[0]
+        return first_line in _NON_CUE_BLOCKS or first_line.startswith(_NON_CUE_PREFIXES)
+
+    @classmethod
+    def __load_cache(cls, cache_path: Path, source_key: tuple[int, int]) -> 'Transcript|None':
+        """
+        returns the cached transcript, or None if the cache is missing, unreadable, from another layout version
+        or was written for a source file with a different (st_mtime_ns, st_size)
+        """
+        try:
+            with open(cache_path, 'rb') as c:
+                cached = pickle.load(c)
+        except Exception:
+            return None
+        if isinstance(cached, tuple) and len(cached) == 3 and cached[0] == _CACHE_VERSION \
+                and cached[1] == source_key and isinstance(cached[2], cls):
+            return cached[2]
+        return None
+
+    def __write_cache(self, cache_path: Path, source_key: tuple[int, int]) -> None:
+        """
+        best-effort cache write: pickles into a temp file next to the cache and swaps it into place,
+        so an interrupted or failed write never leaves a partial cache behind
+        """
+        tmp_path = None
+        try:
+            with tempfile.NamedTemporaryFile('wb', dir=cache_path.parent, prefix=cache_path.name, suffix='.tmp', delete=False) as c:
+                tmp_path = Path(c.name)
+                pickle.dump((_CACHE_VERSION, source_key, self), c, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+        finally:
+            if tmp_path is not None:
+                tmp_path.unlink(missing_ok=True)
+
     def __add_item(self, item: 'TranscriptLine') -> None:
         if self.__lines:
-            silence = item - self.__lines[-1]
+            silence = item.start_us - self.__lines[-1].end_us
             self.__total_silence += silence
             self.__silence_intervals.append(silence)
+            self.__push_silence(silence)
+            self.__update_silence_variance(silence)
         self.__lines.append(item)
-        self.__speakers.add(item.get_speaker())
-        self.__total_speaking_time += item.get_duration()
+        self.__speakers.setdefault(item.speaker, None)
+        duration = item._duration
+        self.__durations.append(duration)
+        self.__total_speaking_time += duration
+
+    def __push_silence(self, silence: int) -> None:
+        """
+        keeps the larger half of the silence intervals in a min-heap and the smaller half (negated) in a max-heap,
+        so the median is always the top of the upper heap
+        """
+        if self.__upper_silences and silence < self.__upper_silences[0]:
+            heapq.heappush(self.__lower_silences, -silence)
+        else:
+            heapq.heappush(self.__upper_silences, silence)
+        if len(self.__upper_silences) > len(self.__lower_silences) + 1:
+            heapq.heappush(self.__lower_silences, -heapq.heappop(self.__upper_silences))
+        elif len(self.__lower_silences) > len(self.__upper_silences):
+            heapq.heappush(self.__upper_silences, -heapq.heappop(self.__lower_silences))
+
+    def __update_silence_variance(self, silence: int) -> None:
+        """
+        Welford's online update of the running mean and sum of squared deviations of silence microseconds
+        """
+        delta = silence - self.__silence_mean
+        self.__silence_mean += delta / len(self.__silence_intervals)
+        self.__silence_m2 += delta * (silence - self.__silence_mean)
 
     def __str__(self) -> str:
-        return '\n\n'.join([str(i + 1) + '\n' + str(self.__lines[i]) for i in range(len(self.__lines))])
+        return '\n\n'.join(f'{i + 1}\n{line}' for i, line in enumerate(self.__lines))
     
+    def write_to(self, fp: TextIO) -> None:
+        """
+        writes the transcript to an open text file line by line, matching print(str(transcript), file=fp)
+        """
+        for i, line in enumerate(self.__lines):
+            if i:
+                fp.write('\n\n')
+            fp.write(f'{i + 1}\n{line}')
+        fp.write('\n')
+
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, type(self)):
             return False
-        return self.num_lines() == other.num_lines() \
-            and all([self.get_lines()[i] == other.get_lines()[i] for i in range(self.num_lines())])
+        return len(self.__lines) == len(other.__lines) \
+            and all(line == other_line for line, other_line in zip(self.__lines, other.__lines))
     
     def num_lines(self):
         return len(self.__lines)
     
     def show_speakers(self) -> str:
-        return '\n'.join(list(self.__speakers))
+        return '\n'.join(self.__speakers)
     
     def map_speakers(self, speaker_map: dict[str,str]) -> 'Transcript':
         mapped = Transcript()
         for line in self.__lines:
-            if line.get_speaker() in speaker_map:
-                mapped.__add_item(TranscriptLine.create(start_time=line.get_start_time(), 
-                                                 end_time=line.get_end_time(), 
-                                                 speaker=speaker_map[line.get_speaker()], 
-                                                 text=line.get_text()))
+            if line.speaker in speaker_map:
+                mapped.__add_item(TranscriptLine(start_us=line.start_us, 
+                                                 end_us=line.end_us, 
+                                                 speaker=speaker_map[line.speaker], 
+                                                 text=line.text))
             else:
                 mapped.__add_item(line)
         return mapped
@@ -63,10 +187,10 @@ class Transcript:
         alternated = Transcript()
         for i in range(len(self.__lines)):
             line = self.__lines[i]
-            alternated.__add_item(TranscriptLine.create(start_time=line.get_start_time(), 
-                                                 end_time=line.get_end_time(), 
+            alternated.__add_item(TranscriptLine(start_us=line.start_us, 
+                                                 end_us=line.end_us, 
                                                  speaker=speaker_names[i % len(speaker_names)], 
-                                                 text=line.get_text()))
+                                                 text=line.text))
         return alternated
     
     def merge(self, merge_predicate: Callable[['TranscriptLine', 'TranscriptLine'], bool]) -> 'Transcript':
@@ -74,30 +198,27 @@ class Transcript:
         merges lines of a transcript on a predicate condition
 
         args:
-            merge_predicate: a Callable that takes an int value i such that 0 <= i < transcript.num_lines() - 1 and returns a bool
+            merge_predicate: a Callable that takes the line merged so far (group start time, group speaker, joined text, end time of its
+                last line) and the current line, and returns True if the current line should be merged into it
         """
         merged = Transcript()
-        next_merged_line = self.__lines[0]
+        group = _MergedLine(self.__lines[0])
         for curr_line in self.__lines[1:]:
-            if merge_predicate(next_merged_line, curr_line):
-                next_merged_line = TranscriptLine.create(
-                    next_merged_line.get_start_time(), 
-                    curr_line.get_end_time(), 
-                    next_merged_line.get_speaker(),
-                    next_merged_line.get_text() + ' ' + curr_line.get_text())
+            if merge_predicate(group, curr_line):
+                group.extend(curr_line)
             else:
-                merged.__add_item(next_merged_line)
-                next_merged_line = curr_line
-        merged.__add_item(next_merged_line)
+                merged.__add_item(group.to_line())
+                group = _MergedLine(curr_line)
+        merged.__add_item(group.to_line())
         return merged
     
     @staticmethod
     def __same_speaker(line1: 'TranscriptLine', line2: 'TranscriptLine') -> bool:
-        return line1.get_speaker() == line2.get_speaker()
+        return line1.speaker == line2.speaker
     
     @staticmethod
-    def __longer_silence(line1: 'TranscriptLine', line2: 'TranscriptLine', interval: timedelta) -> bool:
-        return line2 - line1 >= interval
+    def __longer_silence(line1: 'TranscriptLine', line2: 'TranscriptLine', interval_us: int) -> bool:
+        return line2.start_us - line1.end_us >= interval_us
     
     def merge_by_speaker(self, silence_interval: timedelta|None=None) -> 'Transcript':
         if len(self.__speakers) < 2:
@@ -106,48 +227,42 @@ class Transcript:
         return self.merge(self.__same_speaker)
     
     def merge_by_silence_interval(self, interval:timedelta|None=None, ignore_speakers=False) -> 'Transcript':
-        if interval is None:
-            interval = self.median_silence()
+        interval_us = self.__median_silence_us() if interval is None else interval // _MICROSECOND
         def pred(line1: 'TranscriptLine', line2: 'TranscriptLine') -> bool:
-            return self.__longer_silence(line1, line2, interval)
-        if not ignore_speakers:
-            pred = pred and self.__same_speaker
+            return self.__longer_silence(line1, line2, interval_us) \
+                and (ignore_speakers or self.__same_speaker(line1, line2))
         return self.merge(pred)
     
     def get_silence_intervals(self, sort: bool=False) -> list[timedelta]:
-        if sort:
-            return sorted(self.__silence_intervals)
-        return self.__silence_intervals
+        silence_intervals = sorted(self.__silence_intervals) if sort else self.__silence_intervals
+        return [timedelta(microseconds=silence) for silence in silence_intervals]
 
     def total_time(self) -> timedelta:
-        return self.__lines[-1].get_end_time()
+        return timedelta(microseconds=self.__lines[-1].end_us)
     
     def total_speaking_time(self) -> timedelta:
-        return self.__total_speaking_time
+        return timedelta(microseconds=self.__total_speaking_time)
     
     def total_silence(self) -> timedelta:
-        return self.__total_silence
+        return timedelta(microseconds=self.__total_silence)
     
     def avg_silence(self) -> timedelta:
-        return self.total_silence() / (len(self.__lines) - 1)
+        return timedelta(microseconds=self.__total_silence / (len(self.__lines) - 1))
     
+    def __median_silence_us(self) -> int:
+        return self.__upper_silences[0]
+
     def median_silence(self) -> timedelta:
-        silence_intervals = self.get_silence_intervals(sort=True)
-        return silence_intervals[len(silence_intervals) // 2]
+        return timedelta(microseconds=self.__median_silence_us())
     
     def avg_speaking_time(self) -> timedelta:
-        return self.total_speaking_time() / len(self.__lines)
+        return timedelta(microseconds=self.__total_speaking_time / len(self.__lines))
     
     def median_speaking_time(self) -> timedelta:
-        return sorted(self.__lines, key=lambda x: x.get_duration())[len(self.__lines) // 2].get_duration()
+        return timedelta(microseconds=statistics.median_high(self.__durations))
     
     def std_silence(self) -> timedelta:
-        total_seconds = 0
-        mean = self.avg_silence()
-        for interval in self.get_silence_intervals():
-            total_seconds += (interval - mean).total_seconds() ** 2
-        std_seconds = (total_seconds / (len(self.__lines) - 1)) ** 0.5
-        return timedelta(seconds=std_seconds)
+        return timedelta(microseconds=(self.__silence_m2 / len(self.__silence_intervals)) ** 0.5)
     
     def std_speaking_time(self) -> timedelta:
         return timedelta()
@@ -156,26 +271,34 @@ class Transcript:
         return self.__lines
     
     def consolidate(self) -> str:
-        return '\n\n'.join([f'{line.get_speaker()}: {line.get_text()}' for line in self.__lines])
+        return '\n\n'.join([f'{line.speaker}: {line.text}' for line in self.__lines])
+
+    def write_consolidated(self, fp: TextIO) -> None:
+        """
+        writes the consolidated transcript to an open text file line by line, matching print(transcript.consolidate(), file=fp)
+        """
+        for i, line in enumerate(self.__lines):
+            if i:
+                fp.write('\n\n')
+            fp.write(f'{line.speaker}: {line.text}')
+        fp.write('\n')
 
 class TranscriptLine:
-    def __init__(self):
-        self.__start_time = timedelta()
-        self.__end_time = timedelta()
-        self.__speaker = ''
-        self.__text = ''
+    __slots__ = ('start_us', 'end_us', 'speaker', 'text', '_duration')
+
+    def __init__(self, start_us: int=0, end_us: int=0, speaker: str='', text: str=''):
+        self.start_us = start_us
+        self.end_us = end_us
+        self.speaker = speaker
+        self.text = text
+        self._duration = end_us - start_us
 
     @classmethod
     def create(cls, start_time: timedelta, end_time: timedelta, speaker: str, text: str) -> 'TranscriptLine':
         """ 
         creates a transcript line with raw data
         """
-        obj = cls()
-        obj.__start_time = start_time
-        obj.__end_time = end_time
-        obj.__speaker = speaker
-        obj.__text = text
-        return obj        
+        return cls(start_time // _MICROSECOND, end_time // _MICROSECOND, speaker, text)
 
     @classmethod
     def parse_line(cls, line: str) -> 'TranscriptLine':
@@ -184,84 +307,115 @@ class TranscriptLine:
 
         Expected Input Format:
 
-        <line_number>
+        [<identifier>]
         <start_time> --> <end_time>
         <speaker>: <text>
         """
-        line_pattern = \
-            r'(?P<line_num>[1-9][0-9]*)\n' \
-            r'(?P<start_time>[0-9]{2}:[0-9]{2}:[0-9]{2}\.[0-9]{3}) --> (?P<end_time>[0-9]{2}:[0-9]{2}:[0-9]{2}\.[0-9]{3})\n' \
-            r'(?P<speaker>.+): (?P<text>.+)$'
-        result = re.fullmatch(line_pattern, line)
-        if result is None:
-            raise ValueError(f'Line is not a valid vtt transcript line: \n{line}')
-        obj = cls()
-        obj.__start_time = obj.__parse_time(result.groupdict()['start_time'])
-        obj.__end_time = obj.__parse_time(result.groupdict()['end_time'])
-        obj.__speaker, obj.__text = result.groupdict()['speaker'], result.groupdict()['text']
-        return obj
+        try:
+            start_us, end_us, speaker, text = cls.__scan_cue(line)
+        except ValueError:
+            raise ValueError(f'Line is not a valid vtt transcript line: \n{line}') from None
+        return cls(start_us, end_us, speaker, text)
+
+    @classmethod
+    def __scan_cue(cls, cue: str) -> tuple[int, int, str, str]:
+        """
+        scans a cue block line by line at the fixed offsets of the format above,
+        raising ValueError as soon as the block stops matching it
+        """
+        timing, _, rest = cue.partition('\n')
+        if '-->' not in timing:
+            timing, _, rest = rest.partition('\n')
+        if len(timing) != 29 or timing[12:17] != ' --> ':
+            raise ValueError
+        speaker, sep, text = rest.partition(': ')
+        if not sep or not speaker or ':' in speaker or '\n' in speaker \
+                or not text or text[0] == '\n' or text[-1] == '\n' or '\n\n' in text:
+            raise ValueError
+        return cls.__parse_time(timing[:12]), cls.__parse_time(timing[17:]), speaker, text
     
     def set_speaker(self, new_name) -> None:
-        self.__speaker = new_name
-
-    def __parse_time(self, time: str) -> timedelta:
-        fmt = "%H:%M:%S.%f" 
-        dt = datetime.strptime(time, fmt)
-        result = timedelta(
-            hours=dt.hour,
-            minutes=dt.minute,
-            seconds=dt.second,
-            microseconds=dt.microsecond
-        )
-        return result
+        self.speaker = new_name
+
+    @staticmethod
+    def __parse_time(time: str) -> int:
+        if time[2:9:3] != '::.':
+            raise ValueError(f'Invalid timestamp: {time}')
+        try:
+            seconds = (_TWO_DIGITS[time[0:2]] * 60 + _SIXTY[time[3:5]]) * 60 + _SIXTY[time[6:8]]
+            return seconds * 1_000_000 + _MILLISECONDS_US[time[9:12]]
+        except KeyError:
+            raise ValueError(f'Invalid timestamp: {time}') from None
+    
+    @staticmethod
+    def __format_time(time_us: int) -> str:
+        hours, remainder = divmod(time_us // 1000, 3_600_000)
+        minutes, remainder = divmod(remainder, 60_000)
+        seconds, milliseconds = divmod(remainder, 1000)
+        return f'{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}'
     
     def get_start_time(self) -> timedelta:
-        return self.__start_time
+        return timedelta(microseconds=self.start_us)
     
     def get_end_time(self) -> timedelta:
-        return self.__end_time
+        return timedelta(microseconds=self.end_us)
     
     def get_duration(self) -> timedelta:
-        return self.__end_time - self.__start_time
+        return timedelta(microseconds=self._duration)
     
     def get_speaker(self) -> str:
-        return self.__speaker
+        return self.speaker
     
     def get_text(self) -> str:
-        return self.__text
+        return self.text
     
     def __add__(self, other: 'TranscriptLine') -> 'TranscriptLine':
-        result = TranscriptLine()
-        result.__start_time = self.__start_time
-        result.__end_time = other.__end_time
-        result.__speaker = self.__speaker
-        result.__text = self.__text + ' ' + other.__text
-        return result
+        return TranscriptLine(self.start_us, other.end_us, self.speaker, self.text + ' ' + other.text)
 
     def __sub__(self, other) -> timedelta:
-        return self.get_start_time() - other.get_end_time()
+        return timedelta(microseconds=self.start_us - other.end_us)
     
     def __str__(self):
-        rounded_start = str(self.__start_time).split(':')
-        for i in range(len(rounded_start) - 1):
-            rounded_start[i] = format(int(rounded_start[i]), '02d')
-        rounded_start[-1] = format(float(rounded_start[-1]), '06.3f')
-        rounded_start = ':'.join(rounded_start)
-        rounded_end = str(self.__end_time).split(':')
-        for i in range(len(rounded_end) - 1):
-            rounded_end[i] = format(int(rounded_end[i]), '02d')
-        rounded_end[-1] = format(float(rounded_end[-1]), '06.3f')
-        rounded_end = ':'.join(rounded_end)
-        return f'{rounded_start} --> {rounded_end}\n'\
-            f'{self.__speaker}: {self.__text}'
+        return f'{self.__format_time(self.start_us)} --> {self.__format_time(self.end_us)}\n'\
+            f'{self.speaker}: {self.text}'
     
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, TranscriptLine):
             return False
-        return self.get_start_time() == other.get_start_time() \
-            and self.get_end_time() == other.get_end_time() \
-            and self.get_speaker() == other.get_speaker() \
-            and self.get_text() == other.get_text()
+        return self.start_us == other.start_us \
+            and self.end_us == other.end_us \
+            and self.speaker == other.speaker \
+            and self.text == other.text
+
+class _MergedLine(TranscriptLine):
+    """
+    the line being accumulated by Transcript.merge; texts are collected in a list and only joined when read,
+    so growing a group does not rebuild a TranscriptLine or its text on every merged line
+    """
+    __slots__ = ('_parts', '_joined')
+
+    def __init__(self, first: TranscriptLine):
+        self.start_us = first.start_us
+        self.end_us = first.end_us
+        self.speaker = first.speaker
+        self._duration = first._duration
+        self._parts = [first.text]
+        self._joined: str|None = first.text
+
+    @property
+    def text(self) -> str:
+        if self._joined is None:
+            self._joined = ' '.join(self._parts)
+        return self._joined
+
+    def extend(self, line: TranscriptLine) -> None:
+        self.end_us = line.end_us
+        self._duration = self.end_us - self.start_us
+        self._parts.append(line.text)
+        self._joined = None
+
+    def to_line(self) -> TranscriptLine:
+        return TranscriptLine(self.start_us, self.end_us, self.speaker, self.text)
 
 if __name__ == '__main__':
     t = Transcript.parse_transcript(sys.argv[1])